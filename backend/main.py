@@ -1,21 +1,33 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import Response
 import uvicorn
 import numpy as np
 import json
+import orjson
 import asyncio
 import base64
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 import os
 
+logger = logging.getLogger(__name__)
+
 # Optional imports with fallbacks
 try:
     import cv2
+    # Let imdecode/resize use OpenCV's internal thread pool
+    cv2.setNumThreads(os.cpu_count() or 1)
     CV2_AVAILABLE = True
+    # Run resize/cvtColor through OpenCL (transparent API) when a device exists
+    cv2.ocl.setUseOpenCL(True)
+    OPENCL_AVAILABLE = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
 except ImportError:
     CV2_AVAILABLE = False
+    OPENCL_AVAILABLE = False
     print("OpenCV not available - video processing will be limited")
 
 try:
@@ -25,6 +37,14 @@ except ImportError:
     MEDIAPIPE_AVAILABLE = False
     print("MediaPipe not available - face detection will be limited")
 
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except (ImportError, RuntimeError):
+    TURBOJPEG_AVAILABLE = False
+    print("TurboJPEG not available - using OpenCV for frame decoding")
+
 from models.proctoring_session import ProctorSession, DetectionEvent
 
 # Use simplified models for deployment
@@ -36,6 +56,8 @@ except ImportError:
     print("Using simplified models for deployment")
     from models_simple import ObjectDetector, FocusDetector, ReportGenerator
 
+from models.batched_yolo import BatchedYOLO
+
 app = FastAPI(title="Video Proctoring API", version="1.0.0")
 
 # CORS middleware
@@ -56,26 +78,92 @@ focus_detector = FocusDetector()
 object_detector = ObjectDetector()
 report_generator = ReportGenerator()
 
-# Store active sessions
-active_sessions: Dict[str, ProctorSession] = {}
+# Store sessions; completed ones are kept in the order they ended so the
+# oldest can be evicted first
+active_sessions: "OrderedDict[str, ProctorSession]" = OrderedDict()
+
+# Completed sessions are saved to disk and dropped once more than this many
+# sessions are held in memory
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 100))
+
+# One single-threaded executor per heavy pipeline stage, so decode of frame N+1
+# overlaps focus detection of N and YOLO of N-1 without sharing a detector
+# across threads
+decode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")
+focus_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="focus")
+yolo_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yolo")
+
+# Bound on frames in flight between pipeline stages
+PIPELINE_QUEUE_SIZE = 2
+
+# Decoded frames alive at once per connection: queued between stages plus
+# one being worked on by each stage
+FRAMES_IN_FLIGHT = 3 * PIPELINE_QUEUE_SIZE + 3
+
+# Width frames are downscaled to before detection (MediaPipe and YOLO share it)
+DETECTION_FRAME_WIDTH = 640
+
+# Send session stats at least every N frames even when there are no events
+STATS_INTERVAL = 10
+
+# Run YOLO every N frames per session, reusing the last detections in between
+OBJECT_DETECTION_INTERVAL = 5
+
+# Frames from all sessions share YOLO forward passes
+batched_yolo = BatchedYOLO(object_detector, executor=yolo_executor, max_batch=8, max_wait=0.01)
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """Tracks WebSocket clients, each with its own outbound queue and writer task"""
+    
+    def __init__(self, queue_size: int = 32):
+        self.queue_size = queue_size
+        self.clients: Dict[WebSocket, asyncio.Queue] = {}
+        self.writers: Dict[WebSocket, asyncio.Task] = {}
+        self.session_clients: Dict[str, Set[WebSocket]] = {}
+        self.client_sessions: Dict[WebSocket, str] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, session_id: str):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self.clients[websocket] = queue
+        self.writers[websocket] = asyncio.create_task(self._writer(websocket, queue))
+        self.session_clients.setdefault(session_id, set()).add(websocket)
+        self.client_sessions[websocket] = session_id
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self.clients.pop(websocket, None)
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
+        session_id = self.client_sessions.pop(websocket, None)
+        if session_id is not None:
+            clients = self.session_clients[session_id]
+            clients.discard(websocket)
+            if not clients:
+                del self.session_clients[session_id]
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+    def has_clients(self, session_id: str) -> bool:
+        """Whether any WebSocket is still streaming to this session"""
+        return session_id in self.session_clients
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        """Drain a client's queue so a slow client only ever delays itself"""
+        while True:
+            message = await queue.get()
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message)
+
+    def send_personal_message(self, message: Union[str, bytes], websocket: WebSocket):
+        """Queue a message for one client, dropping its oldest if it's backed up"""
+        queue = self.clients.get(websocket)
+        if queue is not None:
+            put_latest(queue, message)
+
+    def broadcast(self, message: Union[str, bytes]):
+        for queue in self.clients.values():
+            put_latest(queue, message)
 
 manager = ConnectionManager()
 
@@ -89,6 +177,7 @@ async def start_session(candidate_name: str = Form(...)):
     session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     session = ProctorSession(session_id=session_id, candidate_name=candidate_name)
     active_sessions[session_id] = session
+    evict_completed_sessions()
     
     return {
         "session_id": session_id,
@@ -105,10 +194,14 @@ async def end_session(session_id: str):
     
     session = active_sessions[session_id]
     session.end_session()
+    session.get_summary()
+    active_sessions.move_to_end(session_id)
     
     # Generate report
     report_data = report_generator.generate_report(session)
     
+    evict_completed_sessions()
+    
     return {
         "session_id": session_id,
         "end_time": session.end_time.isoformat(),
@@ -117,69 +210,294 @@ async def end_session(session_id: str):
         "status": "completed"
     }
 
+def evict_completed_sessions():
+    """Persist and drop the oldest completed sessions beyond MAX_SESSIONS"""
+    while len(active_sessions) > MAX_SESSIONS:
+        # A completed session can still have a client streaming to it; its
+        # pipeline writes to the event log, so it stays until that disconnects
+        oldest = next(
+            (sid for sid, s in active_sessions.items()
+             if s.end_time is not None and not manager.has_clients(sid)),
+            None
+        )
+        if oldest is None:
+            # Only active or still-connected sessions left; never evict those
+            return
+        
+        session = active_sessions.pop(oldest)
+        try:
+            report_generator.generate_json_report(session)
+        except Exception as e:
+            logger.warning("Failed to persist evicted session %s: %s", oldest, e)
+        session.events.close()
+
 @app.websocket("/ws/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for real-time video processing"""
-    await manager.connect(websocket)
+    await manager.connect(websocket, session_id)
     
     if session_id not in active_sessions:
         await websocket.send_text(json.dumps({"error": "Session not found"}))
+        manager.disconnect(websocket)
         return
     
     session = active_sessions[session_id]
     
+    # receive -> decode -> focus -> yolo -> send, each stage in its own task
+    decode_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    focus_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    yolo_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    send_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    workers = [
+        asyncio.create_task(decode_worker(decode_queue, focus_queue)),
+        asyncio.create_task(focus_worker(focus_queue, yolo_queue)),
+        asyncio.create_task(yolo_worker(yolo_queue, send_queue)),
+        asyncio.create_task(send_worker(send_queue, websocket, session)),
+    ]
+    
+    def on_worker_done(task: asyncio.Task):
+        # Stages only stop when cancelled; anything else leaves the pipeline
+        # dead, so close the connection rather than keep accepting frames
+        if task.cancelled():
+            return
+        logger.error("Pipeline stage for session %s stopped unexpectedly",
+                     session_id, exc_info=task.exception())
+        asyncio.ensure_future(close_websocket(websocket, code=1011))
+    
+    for worker in workers:
+        worker.add_done_callback(on_worker_done)
+    
     try:
         while True:
-            # Receive frame data
-            data = await websocket.receive_text()
-            frame_data = json.loads(data)
+            # Frames arrive as raw JPEG bytes; text messages carry JSON
+            # (including legacy base64 data-URL frames)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             
-            if frame_data.get("type") == "frame":
-                if not CV2_AVAILABLE:
-                    # Send mock response if CV2 not available
-                    await websocket.send_text(json.dumps({
-                        "type": "events",
-                        "events": [],
-                        "timestamp": datetime.now().isoformat()
-                    }))
+            if message.get("bytes") is not None:
+                payload = message["bytes"]
+            else:
+                frame_data = json.loads(message["text"])
+                if frame_data.get("type") != "frame":
                     continue
-                
-                # Decode base64 frame
-                frame_base64 = frame_data["frame"]
-                frame_bytes = base64.b64decode(frame_base64.split(",")[1])
-                nparr = np.frombuffer(frame_bytes, np.uint8)
-                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                
-                # Process frame
-                events = await process_frame(frame, session)
-                
-                # Send events back to client
-                if events:
-                    await websocket.send_text(json.dumps({
-                        "type": "events",
-                        "events": [event.to_dict() for event in events],
-                        "timestamp": datetime.now().isoformat()
-                    }))
-                
-                # Send session stats
-                stats = session.get_session_stats()
-                await websocket.send_text(json.dumps({
-                    "type": "stats",
-                    "stats": stats
-                }))
+                payload = frame_data["frame"]
+            
+            if not CV2_AVAILABLE:
+                # Send mock response if CV2 not available
+                manager.send_personal_message(orjson.dumps({
+                    "type": "update",
+                    "events": [],
+                    "timestamp": datetime.now().isoformat()
+                }), websocket)
+                continue
+            
+            # Latest frame wins if the pipeline is backed up
+            put_latest(decode_queue, (datetime.now(), payload))
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
         print(f"Client disconnected from session {session_id}")
+    finally:
+        for worker in workers:
+            worker.cancel()
+        manager.disconnect(websocket)
+
+async def close_websocket(websocket: WebSocket, code: int = 1000):
+    """Close a WebSocket, ignoring one that is already closed"""
+    try:
+        await websocket.close(code=code)
+    except RuntimeError:
+        pass
+
+def put_latest(queue: asyncio.Queue, item):
+    """Enqueue item, dropping the oldest queued item if the queue is full"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
 
-async def process_frame(frame: np.ndarray, session: ProctorSession) -> List[DetectionEvent]:
-    """Process a single frame and detect events"""
+async def get_latest(queue: asyncio.Queue):
+    """Wait for an item, then skip ahead to the newest one already queued"""
+    item = await queue.get()
+    while not queue.empty():
+        item = queue.get_nowait()
+    return item
+
+class FrameDecoder:
+    """Decodes one connection's JPEG frames into a reused ring of buffers"""
+    
+    def __init__(self, buffer_count: int = FRAMES_IN_FLIGHT):
+        # Enough buffers that none is overwritten while a later stage still reads it
+        self.buffer_count = buffer_count
+        self._buffers: List[np.ndarray] = []
+        self._shape: Optional[Tuple[int, int, int]] = None
+        self._next = 0
+
+    def _next_buffer(self, shape: Tuple[int, int, int]) -> np.ndarray:
+        # Frame size is fixed for a session, so this allocates on the first frame only
+        if shape != self._shape:
+            self._buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.buffer_count)]
+            self._shape = shape
+            self._next = 0
+        buffer = self._buffers[self._next]
+        self._next = (self._next + 1) % self.buffer_count
+        return buffer
+
+    def decode(self, jpeg: bytes) -> Optional[np.ndarray]:
+        """Decode a JPEG to BGR, at half resolution when that still covers DETECTION_FRAME_WIDTH"""
+        if TURBOJPEG_AVAILABLE:
+            try:
+                width, height, _, _ = turbo_jpeg.decode_header(jpeg)
+                if width >= 2 * DETECTION_FRAME_WIDTH:
+                    shape, scaling_factor = ((height + 1) // 2, (width + 1) // 2, 3), (1, 2)
+                else:
+                    shape, scaling_factor = (height, width, 3), None
+                return turbo_jpeg.decode(
+                    jpeg, pixel_format=TJPF_BGR, scaling_factor=scaling_factor,
+                    dst=self._next_buffer(shape)
+                )
+            except (IOError, ValueError):
+                return None
+        
+        # Decoding straight to half size is much cheaper than a full decode + resize,
+        # but only when the half-size frame is still at least detection size
+        size = jpeg_size(jpeg)
+        if size is not None and size[0] >= 2 * DETECTION_FRAME_WIDTH:
+            flags = cv2.IMREAD_REDUCED_COLOR_2
+        else:
+            flags = cv2.IMREAD_COLOR
+        return cv2.imdecode(np.frombuffer(jpeg, np.uint8), flags)
+
+def jpeg_size(jpeg: bytes) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from a JPEG's frame header without decoding it"""
+    if jpeg[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(jpeg):
+        if jpeg[i] != 0xFF:
+            return None
+        marker = jpeg[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        # Start-of-frame markers (all but DHT, JPG and DAC in 0xC0-0xCF) hold the size
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(jpeg[i + 5:i + 7], "big")
+            width = int.from_bytes(jpeg[i + 7:i + 9], "big")
+            return width, height
+        if marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        i += 2 + int.from_bytes(jpeg[i + 2:i + 4], "big")
+    return None
+
+def decode_frame(payload: Union[bytes, str], decoder: FrameDecoder) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Decode a JPEG frame (raw bytes or base64 data-URL) for detection
+    
+    Returns:
+        (bgr, rgb) copies of the frame at detection size, or None if undecodable
+    """
+    if isinstance(payload, str):
+        try:
+            payload = base64.b64decode(payload.split(",")[1])
+        except (IndexError, ValueError):
+            return None
+    frame = decoder.decode(payload)
+    if frame is None:
+        return None
+    
+    height, width = frame.shape[:2]
+    if width > DETECTION_FRAME_WIDTH:
+        size = (DETECTION_FRAME_WIDTH, round(height * DETECTION_FRAME_WIDTH / width))
+        if OPENCL_AVAILABLE:
+            # Large frames: upload once and do both passes on the device
+            try:
+                small = cv2.resize(cv2.UMat(frame), size, interpolation=cv2.INTER_AREA)
+                return small.get(), cv2.cvtColor(small, cv2.COLOR_BGR2RGB).get()
+            except cv2.error:
+                pass
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    
+    # Convert once; MediaPipe takes RGB, YOLO takes BGR
+    return frame, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+async def decode_worker(in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+    """Pipeline stage: decode received frames"""
+    loop = asyncio.get_running_loop()
+    decoder = FrameDecoder()
+    while True:
+        # Stale frames are dropped so latency stays near one frame's processing time
+        current_time, payload = await get_latest(in_queue)
+        try:
+            frames = await loop.run_in_executor(decode_executor, decode_frame, payload, decoder)
+        except Exception:
+            logger.exception("Frame decoding failed; skipping frame")
+            continue
+        if frames is not None:
+            await out_queue.put((current_time, *frames))
+
+async def focus_worker(in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+    """Pipeline stage: run focus detection"""
+    loop = asyncio.get_running_loop()
+    focus_state: Dict = {}  # per-connection face mesh cadence
+    while True:
+        current_time, frame, rgb_frame = await in_queue.get()
+        try:
+            focus_results = await loop.run_in_executor(
+                focus_executor, focus_detector.detect_focus, rgb_frame, focus_state
+            )
+        except Exception:
+            logger.exception("Focus detection failed; skipping frame")
+            continue
+        await out_queue.put((current_time, frame, focus_results))
+
+async def yolo_worker(in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+    """Pipeline stage: run object detection, batched with other sessions' frames"""
+    frame_index = 0
+    object_results: List[Dict] = []
+    while True:
+        current_time, frame, focus_results = await in_queue.get()
+        if frame_index % OBJECT_DETECTION_INTERVAL == 0:
+            try:
+                object_results = await batched_yolo.submit(frame)
+            except Exception:
+                # Keep the previous detections; the next cadence frame retries
+                logger.exception("Object detection failed; reusing last detections")
+        frame_index += 1
+        await out_queue.put((current_time, focus_results, object_results))
+
+async def send_worker(in_queue: asyncio.Queue, websocket: WebSocket, session: ProctorSession):
+    """Pipeline stage: record events and send them back to the client"""
+    frames_since_stats = 0
+    while True:
+        current_time, focus_results, object_results = await in_queue.get()
+        try:
+            events = process_frame(focus_results, object_results, session, current_time)
+            
+            # Session stats ride along with events, or go out every STATS_INTERVAL frames
+            frames_since_stats += 1
+            if not events and frames_since_stats < STATS_INTERVAL:
+                continue
+            frames_since_stats = 0
+            
+            # One message per frame: events and stats together. Events share the
+            # frame's timestamp, so its ISO string is formatted at most once
+            manager.send_personal_message(orjson.dumps({
+                "type": "update",
+                "events": [event.to_dict() for event in events],
+                "stats": session.get_session_stats(),
+                "timestamp": events[0].timestamp_iso() if events else current_time.isoformat()
+            }, option=orjson.OPT_SERIALIZE_NUMPY), websocket)
+        except Exception:
+            logger.exception("Recording or sending events failed; skipping frame")
+
+def process_frame(focus_results: Dict, object_results: List[Dict], session: ProctorSession,
+                  current_time: datetime) -> List[DetectionEvent]:
+    """Turn a frame's detector results into session events"""
     events = []
-    current_time = datetime.now()
     
     # Focus detection
-    focus_results = focus_detector.detect_focus(frame)
-    
     if not focus_results["face_detected"]:
         event = DetectionEvent(
             event_type="no_face",
@@ -187,7 +505,6 @@ async def process_frame(frame: np.ndarray, session: ProctorSession) -> List[Dete
             timestamp=current_time,
             details={"message": "No face detected"}
         )
-        session.add_event(event)
         events.append(event)
     
     elif focus_results["multiple_faces"]:
@@ -197,7 +514,6 @@ async def process_frame(frame: np.ndarray, session: ProctorSession) -> List[Dete
             timestamp=current_time,
             details={"face_count": focus_results["face_count"]}
         )
-        session.add_event(event)
         events.append(event)
     
     elif not focus_results["looking_at_camera"]:
@@ -207,19 +523,18 @@ async def process_frame(frame: np.ndarray, session: ProctorSession) -> List[Dete
             timestamp=current_time,
             details=focus_results["gaze_data"]
         )
-        session.add_event(event)
         events.append(event)
     
-    # Object detection
-    object_results = object_detector.detect_objects(frame)
-    
-    # Log detections for debugging
-    if object_results:
-        print(f"[DEBUG] Detected objects: {[det['class'] for det in object_results]}")
+    # Log detections for debugging; skip building the messages unless enabled
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if object_results and debug:
+        logger.debug("Detected objects: %s", [det['class'] for det in object_results])
     
     for detection in object_results:
         if detection["class"] in ["phone", "book", "laptop", "tablet"]:
-            print(f"[DEBUG] Phone/Object detected: {detection['class']} with confidence {detection['confidence']}")
+            if debug:
+                logger.debug("Phone/Object detected: %s with confidence %s",
+                             detection['class'], detection['confidence'])
             event = DetectionEvent(
                 event_type="unauthorized_object",
                 confidence=detection["confidence"],
@@ -229,9 +544,9 @@ async def process_frame(frame: np.ndarray, session: ProctorSession) -> List[Dete
                     "bbox": detection["bbox"]
                 }
             )
-            session.add_event(event)
             events.append(event)
     
+    session.add_events(events)
     return events
 
 @app.get("/api/session/{session_id}/report")
@@ -251,29 +566,20 @@ async def download_pdf_report(session_id: str):
         return {"error": "Session not found"}
     
     session = active_sessions[session_id]
-    pdf_path = report_generator.generate_pdf_report(session)
+    pdf_bytes = report_generator.generate_pdf_bytes(session)
     
-    return FileResponse(
-        pdf_path,
+    # Served from memory; no need to write the file and read it back
+    return Response(
+        pdf_bytes,
         media_type="application/pdf",
-        filename=f"proctoring_report_{session_id}.pdf"
+        headers={"Content-Disposition": f'attachment; filename="proctoring_report_{session_id}.pdf"'}
     )
 #get api for sessions
 @app.get("/api/sessions")
 async def get_all_sessions():
     """Get all sessions"""
-    sessions_data = []
-    for session_id, session in active_sessions.items():
-        sessions_data.append({
-            "session_id": session_id,
-            "candidate_name": session.candidate_name,
-            "start_time": session.start_time.isoformat(),
-            "status": "active" if session.end_time is None else "completed",
-            "duration": session.get_duration(),
-            "event_count": len(session.events)
-        })
-    
-    return {"sessions": sessions_data}
+    # Completed sessions return their cached summary
+    return {"sessions": [session.get_summary() for session in active_sessions.values()]}
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+from concurrent.futures import Executor
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+class BatchedYOLO:
+    """Collects frames from all sessions and runs them through the detector in batches"""
+    
+    def __init__(self, detector, executor: Optional[Executor] = None,
+                 max_batch: int = 8, max_wait: float = 0.01):
+        self.detector = detector
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # seconds to wait for a batch to fill
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        
+    async def submit(self, frame: np.ndarray) -> List[Dict[str, Any]]:
+        """Queue a frame for the next batch and wait for its detections"""
+        # (Re)start the batching task on the loop we are called from
+        if self._task is None or self._task.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((frame, future))
+        return await future
+    
+    async def _drain(self) -> List[tuple]:
+        """Wait for one item, then collect more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        
+        while len(items) < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        return items
+    
+    async def _run(self):
+        """Background task: run one forward pass per batch and hand results back"""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._drain()
+            # Drop frames whose submitter has gone away (e.g. client disconnected)
+            items = [(frame, future) for frame, future in items if not future.done()]
+            if not items:
+                continue
+            
+            frames = [frame for frame, _ in items]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.detector.detect_objects_batch, frames
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), detections in zip(items, results):
+                if not future.done():
+                    future.set_result(detections)
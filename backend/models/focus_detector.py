@@ -1,6 +1,8 @@
 import numpy as np
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import math
+import threading
 
 # Optional imports with fallbacks
 try:
@@ -15,6 +17,45 @@ try:
 except ImportError:
     MEDIAPIPE_AVAILABLE = False
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    
+    def njit(*args, **kwargs):
+        """No-op stand-in so the kernels below run as plain Python"""
+        return lambda func: func
+
+# 3D model points (generic face model)
+HEAD_POSE_MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),             # Nose tip
+    (0.0, -330.0, -65.0),        # Chin
+    (-225.0, 170.0, -135.0),     # Left eye left corner
+    (225.0, 170.0, -135.0),      # Right eye right corner
+    (-150.0, -150.0, -125.0),    # Left Mouth corner
+    (150.0, -150.0, -125.0)      # Right mouth corner
+])
+
+# Face mesh landmark indices matching HEAD_POSE_MODEL_POINTS
+HEAD_POSE_LANDMARKS = (1, 152, 33, 263, 61, 291)
+
+@njit(cache=True, fastmath=True)
+def ear_kernel(pts):
+    """Eye Aspect Ratio from a (6, 2) array of eye landmark coordinates"""
+    A = math.sqrt((pts[1, 0] - pts[5, 0]) ** 2 + (pts[1, 1] - pts[5, 1]) ** 2)
+    B = math.sqrt((pts[2, 0] - pts[4, 0]) ** 2 + (pts[2, 1] - pts[4, 1]) ** 2)
+    C = math.sqrt((pts[0, 0] - pts[3, 0]) ** 2 + (pts[0, 1] - pts[3, 1]) ** 2)
+    return (A + B) / (2.0 * C)
+
+@njit(cache=True, fastmath=True)
+def euler_from_rotation(R):
+    """Yaw, pitch and roll in degrees from a 3x3 rotation matrix"""
+    yaw = math.atan2(R[1, 0], R[0, 0]) * 180 / math.pi
+    pitch = math.atan2(-R[2, 0], math.sqrt(R[2, 1] ** 2 + R[2, 2] ** 2)) * 180 / math.pi
+    roll = math.atan2(R[2, 1], R[2, 2]) * 180 / math.pi
+    return yaw, pitch, roll
+
 class FocusDetector:
     """Detects if candidate is focused using MediaPipe Face Detection and Pose"""
     
@@ -28,6 +69,14 @@ class FocusDetector:
         self.face_mesh = None
         self.pose = None
         
+        # MediaPipe graphs are independent and release the GIL, so face mesh
+        # runs on its own thread alongside face detection; each graph gets its
+        # own lock so it's never entered concurrently
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="face_mesh")
+        self._face_detection_lock = threading.Lock()
+        self._face_mesh_lock = threading.Lock()
+        self._pose_lock = threading.Lock()
+        
         if MEDIAPIPE_AVAILABLE:
             try:
                 # Initialize MediaPipe
@@ -47,10 +96,7 @@ class FocusDetector:
                     min_detection_confidence=0.5,
                     min_tracking_confidence=0.5
                 )
-                self.pose = self.mp_pose.Pose(
-                    min_detection_confidence=0.5,
-                    min_tracking_confidence=0.5
-                )
+                # Pose is only a fallback, so it's built on first use (see _get_pose)
             except Exception as e:
                 print(f"Failed to initialize MediaPipe: {e}")
         
@@ -61,9 +107,26 @@ class FocusDetector:
         # Head pose thresholds
         self.HEAD_POSE_THRESHOLD = 25  # degrees
         
-    def detect_focus(self, frame: np.ndarray) -> Dict[str, Any]:
+        # Run face mesh every N frames, reusing the last analysis in between
+        self.FACE_MESH_INTERVAL = 2
+        
+        # Camera matrix and distortion coefficients for head pose, keyed by (height, width)
+        self._cam_cache: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]] = {}
+        
+        # Reused landmark buffer for the EAR kernel
+        self._ear_buf = np.empty((6, 2), dtype=np.float32)
+        
+        # Cadence state used when the caller doesn't track its own
+        self._default_state: Dict[str, Any] = {}
+        
+    def detect_focus(self, rgb_frame: np.ndarray, state: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        Detect focus-related metrics from a video frame
+        Detect focus-related metrics from an RGB video frame
+        
+        Args:
+            rgb_frame: frame in RGB order
+            state: per-stream dict carrying frame cadence and the last face
+                mesh analysis between calls (one per video stream)
         
         Returns:
             Dict containing:
@@ -87,63 +150,63 @@ class FocusDetector:
                 'eye_closure': False
             }
             
-        try:
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if state is None:
+            state = self._default_state
+        frame_index = state.get("frame_index", 0)
+        state["frame_index"] = frame_index + 1
+        
+        # Face mesh only runs every FACE_MESH_INTERVAL frames; in between the
+        # last head pose is reused since focus changes slowly relative to fps
+        face_mesh_due = frame_index % self.FACE_MESH_INTERVAL == 0 or "face_mesh" not in state
             
-            # Face detection
-            face_results = self.face_detection.process(rgb_frame)
-            face_mesh_results = self.face_mesh.process(rgb_frame)
-            pose_results = self.pose.process(rgb_frame)
+        try:
+            # If there was a face last frame, run face mesh alongside face
+            # detection; otherwise wait to see whether there's a face at all
+            face_mesh_future = None
+            if face_mesh_due and state.get("face_seen", False):
+                face_mesh_future = self._pool.submit(
+                    self._process, self.face_mesh, self._face_mesh_lock, rgb_frame
+                )
+            face_results = self._process(self.face_detection, self._face_detection_lock, rgb_frame)
+            state["face_seen"] = bool(face_results.detections)
             
             result = {
-            "face_detected": False,
-            "multiple_faces": False,
-            "face_count": 0,
-            "looking_at_camera": True,
-            "confidence": 0.0,
-            "gaze_data": {},
-            "eye_closure": False,
-            "head_pose": {}
-        }
-        
-        # Check for faces
-        if face_results.detections:
-            result["face_detected"] = True
-            result["face_count"] = len(face_results.detections)
-            result["multiple_faces"] = len(face_results.detections) > 1
-            result["confidence"] = face_results.detections[0].score[0]
-        
-        # Analyze face mesh for gaze direction and eye closure
-        if face_mesh_results.multi_face_landmarks:
-            for face_landmarks in face_mesh_results.multi_face_landmarks:
-                # Head pose estimation
-                head_pose = self._estimate_head_pose(face_landmarks, frame.shape)
-                result["head_pose"] = head_pose
-                
-                # Check if looking at camera based on head pose
-                if abs(head_pose["yaw"]) > self.HEAD_POSE_THRESHOLD or abs(head_pose["pitch"]) > self.HEAD_POSE_THRESHOLD:
-                    result["looking_at_camera"] = False
-                
-                result["gaze_data"] = {
-                    "head_yaw": head_pose["yaw"],
-                    "head_pitch": head_pose["pitch"],
-                    "head_roll": head_pose["roll"]
-                }
-                
-                # Eye closure detection (bonus)
-                eye_closure = self._detect_eye_closure(face_landmarks)
-                result["eye_closure"] = eye_closure
-                
-                break  # Use first face only
+                "face_detected": False,
+                "multiple_faces": False,
+                "face_count": 0,
+                "looking_at_camera": True,
+                "confidence": 0.0,
+                "gaze_data": {},
+                "eye_closure": False,
+                "head_pose": {}
+            }
         
-        # Use pose estimation as backup for head orientation
-        if pose_results.pose_landmarks and not result["face_detected"]:
-            nose_landmark = pose_results.pose_landmarks.landmark[self.mp_pose.PoseLandmark.NOSE]
-            if nose_landmark.visibility > 0.5:
-                # Simple pose-based detection
+            # Check for faces
+            if face_results.detections:
                 result["face_detected"] = True
-                result["face_count"] = 1
-                result["confidence"] = nose_landmark.visibility
+                result["face_count"] = len(face_results.detections)
+                result["multiple_faces"] = len(face_results.detections) > 1
+                result["confidence"] = face_results.detections[0].score[0]
+                
+                # Analyze face mesh for gaze direction and eye closure
+                if face_mesh_future is not None:
+                    face_mesh_results = face_mesh_future.result()
+                    state["face_mesh"] = self._analyze_face_mesh(face_mesh_results, rgb_frame.shape)
+                elif face_mesh_due:
+                    face_mesh_results = self._process(self.face_mesh, self._face_mesh_lock, rgb_frame)
+                    state["face_mesh"] = self._analyze_face_mesh(face_mesh_results, rgb_frame.shape)
+                result.update(state["face_mesh"])
+            
+            else:
+                # Use pose estimation as backup when no face was detected
+                pose_results = self._process(self._get_pose(), self._pose_lock, rgb_frame)
+                if pose_results.pose_landmarks:
+                    nose_landmark = pose_results.pose_landmarks.landmark[self.mp_pose.PoseLandmark.NOSE]
+                    if nose_landmark.visibility > 0.5:
+                        # Simple pose-based detection
+                        result["face_detected"] = True
+                        result["face_count"] = 1
+                        result["confidence"] = nose_landmark.visibility
         
             return result
             
@@ -159,45 +222,86 @@ class FocusDetector:
                 'eye_closure': False
             }
     
+    def _analyze_face_mesh(self, face_mesh_results, image_shape) -> Dict[str, Any]:
+        """Derive head pose, gaze and eye closure from face mesh results"""
+        analysis = {
+            "looking_at_camera": True,
+            "gaze_data": {},
+            "eye_closure": False,
+            "head_pose": {}
+        }
+        
+        if face_mesh_results.multi_face_landmarks:
+            # Use first face only
+            face_landmarks = face_mesh_results.multi_face_landmarks[0]
+            
+            # Head pose estimation
+            head_pose = self._estimate_head_pose(face_landmarks, image_shape)
+            analysis["head_pose"] = head_pose
+            
+            # Check if looking at camera based on head pose
+            if abs(head_pose["yaw"]) > self.HEAD_POSE_THRESHOLD or abs(head_pose["pitch"]) > self.HEAD_POSE_THRESHOLD:
+                analysis["looking_at_camera"] = False
+            
+            analysis["gaze_data"] = {
+                "head_yaw": head_pose["yaw"],
+                "head_pitch": head_pose["pitch"],
+                "head_roll": head_pose["roll"]
+            }
+            
+            # Eye closure detection (bonus)
+            analysis["eye_closure"] = self._detect_eye_closure(face_landmarks)
+        
+        return analysis
+    
+    def _get_pose(self):
+        """Return the pose graph, creating it the first time a fallback is needed"""
+        with self._pose_lock:
+            if self.pose is None:
+                self.pose = self.mp_pose.Pose(
+                    min_detection_confidence=0.5,
+                    min_tracking_confidence=0.5
+                )
+            return self.pose
+    
+    def _process(self, graph, lock: threading.Lock, rgb_frame: np.ndarray):
+        """Run a MediaPipe graph on a frame while holding its lock"""
+        with lock:
+            return graph.process(rgb_frame)
+    
     def _estimate_head_pose(self, landmarks, image_shape) -> Dict[str, float]:
         """Estimate head pose from face landmarks"""
         height, width = image_shape[:2]
         
-        # 3D model points (generic face model)
-        model_points = np.array([
-            (0.0, 0.0, 0.0),             # Nose tip
-            (0.0, -330.0, -65.0),        # Chin
-            (-225.0, 170.0, -135.0),     # Left eye left corner
-            (225.0, 170.0, -135.0),      # Right eye right corner
-            (-150.0, -150.0, -125.0),    # Left Mouth corner
-            (150.0, -150.0, -125.0)      # Right mouth corner
-        ])
-        
-        # 2D image points from landmarks
-        image_points = np.array([
-            (landmarks.landmark[1].x * width, landmarks.landmark[1].y * height),     # Nose tip
-            (landmarks.landmark[152].x * width, landmarks.landmark[152].y * height), # Chin
-            (landmarks.landmark[33].x * width, landmarks.landmark[33].y * height),   # Left eye left corner
-            (landmarks.landmark[263].x * width, landmarks.landmark[263].y * height), # Right eye right corner
-            (landmarks.landmark[61].x * width, landmarks.landmark[61].y * height),   # Left mouth corner
-            (landmarks.landmark[291].x * width, landmarks.landmark[291].y * height)  # Right mouth corner
-        ], dtype="double")
+        # 2D image points from landmarks, scaled to pixels
+        lm = landmarks.landmark
+        image_points = np.fromiter(
+            (v for i in HEAD_POSE_LANDMARKS for v in (lm[i].x, lm[i].y)),
+            dtype=np.float64, count=len(HEAD_POSE_LANDMARKS) * 2
+        ).reshape(-1, 2)
+        image_points *= (width, height)
         
-        # Camera internals
-        focal_length = width
-        center = (width/2, height/2)
-        camera_matrix = np.array([
-            [focal_length, 0, center[0]],
-            [0, focal_length, center[1]],
-            [0, 0, 1]
-        ], dtype="double")
+        # Camera internals (depend only on frame size, so built once per size)
+        key = (height, width)
+        cached = self._cam_cache.get(key)
+        if cached is None:
+            focal_length = width
+            center = (width/2, height/2)
+            camera_matrix = np.array([
+                [focal_length, 0, center[0]],
+                [0, focal_length, center[1]],
+                [0, 0, 1]
+            ], dtype="double")
+            dist_coeffs = np.zeros((4,1))  # Assuming no lens distortion
+            self._cam_cache[key] = (camera_matrix, dist_coeffs)
+        else:
+            camera_matrix, dist_coeffs = cached
         
-        dist_coeffs = np.zeros((4,1))  # Assuming no lens distortion
-        
-        # Solve PnP
+        # Solve PnP (EPnP is non-iterative and fast for a handful of points)
         try:
             success, rotation_vector, translation_vector = cv2.solvePnP(
-                model_points, image_points, camera_matrix, dist_coeffs
+                HEAD_POSE_MODEL_POINTS, image_points, camera_matrix, dist_coeffs,
+                flags=cv2.SOLVEPNP_EPNP
             )
             
             if success:
@@ -205,10 +309,7 @@ class FocusDetector:
                 rotation_matrix, _ = cv2.Rodrigues(rotation_vector)
                 
                 # Calculate Euler angles
-                yaw = math.atan2(rotation_matrix[1,0], rotation_matrix[0,0]) * 180 / math.pi
-                pitch = math.atan2(-rotation_matrix[2,0], 
-                                 math.sqrt(rotation_matrix[2,1]**2 + rotation_matrix[2,2]**2)) * 180 / math.pi
-                roll = math.atan2(rotation_matrix[2,1], rotation_matrix[2,2]) * 180 / math.pi
+                yaw, pitch, roll = euler_from_rotation(rotation_matrix)
                 
                 return {"yaw": yaw, "pitch": pitch, "roll": roll}
             else:
@@ -235,22 +336,14 @@ class FocusDetector:
     def _calculate_ear(self, landmarks, eye_indices) -> float:
         """Calculate Eye Aspect Ratio for given eye landmarks"""
         try:
-            # Get eye points
-            eye_points = []
-            for idx in eye_indices[:6]:  # Use first 6 points for basic EAR calculation
+            # Get first 6 eye points for basic EAR calculation
+            eye_points = self._ear_buf
+            for i, idx in enumerate(eye_indices[:6]):
                 point = landmarks.landmark[idx]
-                eye_points.append([point.x, point.y])
-            
-            eye_points = np.array(eye_points)
-            
-            # Calculate distances
-            A = np.linalg.norm(eye_points[1] - eye_points[5])
-            B = np.linalg.norm(eye_points[2] - eye_points[4])
-            C = np.linalg.norm(eye_points[0] - eye_points[3])
+                eye_points[i, 0] = point.x
+                eye_points[i, 1] = point.y
             
-            # EAR calculation
-            ear = (A + B) / (2.0 * C)
-            return ear
+            return float(ear_kernel(eye_points))
         except:
             return 1.0  # Default to eyes open if calculation fails
     
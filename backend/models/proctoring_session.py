@@ -1,25 +1,173 @@
+from collections import Counter, deque
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Iterator, Sequence
+from dataclasses import dataclass, asdict, field
 import json
+import numpy as np
+import orjson
+import os
+import sqlite3
+import time
 
-@dataclass
+# Where each session's full event log is written
+SESSIONS_DIR = "sessions"
+
+# Events kept in memory per session; older ones are read back from disk
+RECENT_EVENTS = 1000
+
+# Total seconds beyond which looking away / being absent counts as an integrity issue
+LOOKING_AWAY_VIOLATION_SECONDS = 5
+FACE_ABSENT_VIOLATION_SECONDS = 10
+
+# Event type -> (confidence threshold, severity below it, severity at or above it)
+_SEVERITY_TABLE = {
+    "looking_away": (0.7, "low", "medium"),
+    "no_face": (0.8, "medium", "high"),
+    "multiple_faces": (0.0, "high", "high"),
+    "unauthorized_object": (0.0, "critical", "critical")
+}
+_DEFAULT_SEVERITY = (1.0, "low", "low")
+SEVERITY_LEVELS = ("low", "medium", "high", "critical")
+
+# Known event types get small integer codes for vectorized counting;
+# anything else shares the last code
+EVENT_TYPES = ("looking_away", "no_face", "multiple_faces", "unauthorized_object")
+_TYPE_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+OTHER_TYPE_CODE = len(EVENT_TYPES)
+
+# _SEVERITY_TABLE as arrays indexed by type code, severities as SEVERITY_LEVELS indices
+_severity_rows = [_SEVERITY_TABLE.get(event_type, _DEFAULT_SEVERITY) for event_type in EVENT_TYPES]
+_severity_rows.append(_DEFAULT_SEVERITY)
+_SEVERITY_THRESHOLDS = np.array([row[0] for row in _severity_rows])
+_SEVERITY_BELOW = np.array([SEVERITY_LEVELS.index(row[1]) for row in _severity_rows])
+_SEVERITY_AT_OR_ABOVE = np.array([SEVERITY_LEVELS.index(row[2]) for row in _severity_rows])
+
+def json_dumps(obj: Any) -> str:
+    """Serialize to a compact JSON string"""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+def event_severity(event_type: str, confidence: float) -> str:
+    """Determine event severity"""
+    threshold, below, at_or_above = _SEVERITY_TABLE.get(event_type, _DEFAULT_SEVERITY)
+    return below if confidence < threshold else at_or_above
+
+def severity_levels(type_codes: np.ndarray, confidences: np.ndarray) -> np.ndarray:
+    """Severity of each event as an index into SEVERITY_LEVELS, from arrays of type codes and confidences"""
+    return np.where(
+        confidences < _SEVERITY_THRESHOLDS[type_codes],
+        _SEVERITY_BELOW[type_codes],
+        _SEVERITY_AT_OR_ABOVE[type_codes]
+    )
+
+@dataclass(slots=True)
 class DetectionEvent:
     """Represents a single detection event during proctoring"""
     event_type: str  # 'looking_away', 'no_face', 'multiple_faces', 'unauthorized_object'
     confidence: float
     timestamp: datetime
     details: Dict[str, Any]
+    _iso: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    severity: str = field(init=False, repr=False, compare=False)
+    hour: int = field(init=False, repr=False, compare=False)
+    type_code: int = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Computed once here so report building never re-derives them
+        self.severity = event_severity(self.event_type, self.confidence)
+        self.hour = self.timestamp.hour
+        self.type_code = _TYPE_CODES.get(self.event_type, OTHER_TYPE_CODE)
+    
+    def timestamp_iso(self) -> str:
+        """ISO-formatted timestamp, formatted once and cached"""
+        if self._iso is None:
+            self._iso = self.timestamp.isoformat()
+        return self._iso
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
         return {
             "event_type": self.event_type,
             "confidence": self.confidence,
-            "timestamp": self.timestamp.isoformat(),
+            "timestamp": self.timestamp_iso(),
             "details": self.details
         }
 
+class EventLog:
+    """Append-only event store: recent events in memory, every event in SQLite"""
+    
+    def __init__(self, session_id: str, maxlen: int = RECENT_EVENTS):
+        self.path = self._create_file(session_id)
+        self.recent: deque = deque(maxlen=maxlen)
+        self._count = 0
+        
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL with synchronous=NORMAL keeps the per-batch commit cheap
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE events (timestamp TEXT, event_type TEXT, confidence REAL, details TEXT)"
+        )
+        self._db.commit()
+        
+    @staticmethod
+    def _create_file(session_id: str) -> str:
+        """Claim a new database file, never reusing an existing session's log"""
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        path = f"{SESSIONS_DIR}/{session_id}.db"
+        suffix = 1
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                path = f"{SESSIONS_DIR}/{session_id}-{suffix}.db"
+                suffix += 1
+        
+    def append(self, event: DetectionEvent):
+        """Record an event"""
+        self.extend((event,))
+        
+    def extend(self, events: Sequence[DetectionEvent]):
+        """Record several events with one database call and commit them"""
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO events VALUES (?, ?, ?, ?)",
+                [(event.timestamp_iso(), event.event_type, float(event.confidence),
+                  json_dumps(event.details)) for event in events]
+            )
+        self.recent.extend(events)
+        self._count += len(events)
+        
+    def __len__(self) -> int:
+        return self._count
+    
+    def __iter__(self) -> Iterator[DetectionEvent]:
+        """Iterate over all events in the order they were added"""
+        if self._count == len(self.recent):
+            return iter(list(self.recent))
+        
+        rows = self._db.execute(
+            "SELECT timestamp, event_type, confidence, details FROM events ORDER BY rowid"
+        ).fetchall()
+        return (
+            DetectionEvent(
+                event_type=event_type,
+                confidence=confidence,
+                timestamp=datetime.fromisoformat(timestamp),
+                details=json.loads(details)
+            )
+            for timestamp, event_type, confidence, details in rows
+        )
+    
+    def flush(self):
+        """Commit pending writes to disk"""
+        self._db.commit()
+        
+    def close(self):
+        """Commit and release the database"""
+        self._db.commit()
+        self._db.close()
+
 class ProctorSession:
     """Manages a single proctoring session"""
     
@@ -28,71 +176,145 @@ class ProctorSession:
         self.candidate_name = candidate_name
         self.start_time = datetime.now()
         self.end_time: Optional[datetime] = None
-        self.events: List[DetectionEvent] = []
+        # Wall-clock times above are for reporting; durations use time.monotonic()
+        self._start_mono = time.monotonic()
+        self._end_mono: Optional[float] = None
+        self.events = EventLog(session_id)
         
         # Tracking variables
         self.total_looking_away_time = 0
         self.total_no_face_time = 0
-        self.face_absent_start = None
-        self.looking_away_start = None
+        self.face_absent_start: Optional[float] = None
+        self.looking_away_start: Optional[float] = None
         self.consecutive_frames_no_face = 0
         self.consecutive_frames_looking_away = 0
         
+        # Per-type event counts, updated as events are added
+        self._event_counts: Counter = Counter()
+        
+        # Integrity issue flags; set once their threshold is crossed and never cleared
+        self._looking_away_violation = False
+        self._face_absent_violation = False
+        self._multiple_faces_seen = False
+        self._unauthorized_object_seen = False
+        
+        # Listing summary, frozen once the session has ended
+        self._summary: Optional[Dict[str, Any]] = None
+        
+        # Last stats dict and the event count it was built at
+        self._stats_cache: Optional[Dict[str, Any]] = None
+        self._stats_cache_n = -1
+        
     def add_event(self, event: DetectionEvent):
         """Add a detection event to the session"""
-        self.events.append(event)
-        self._update_tracking_metrics(event)
+        self.add_events((event,))
+        
+    def add_events(self, batch: Sequence[DetectionEvent]):
+        """Add several detection events (e.g. all of one frame's) in order"""
+        if not batch:
+            return
+        self.events.extend(batch)
+        self._event_counts.update(event.event_type for event in batch)
+        self._multiple_faces_seen = self._event_counts["multiple_faces"] > 0
+        self._unauthorized_object_seen = self._event_counts["unauthorized_object"] > 0
+        self._update_tracking_metrics(batch)
         
-    def _update_tracking_metrics(self, event: DetectionEvent):
+    def _update_tracking_metrics(self, batch: Sequence[DetectionEvent]):
         """Update session tracking metrics based on events"""
-        current_time = datetime.now()
-        
-        if event.event_type == "no_face":
-            self.consecutive_frames_no_face += 1
-            if self.face_absent_start is None:
-                self.face_absent_start = current_time
-        else:
-            if self.face_absent_start is not None:
-                self.total_no_face_time += (current_time - self.face_absent_start).total_seconds()
-                self.face_absent_start = None
-            self.consecutive_frames_no_face = 0
+        # Events in a batch arrive together, so one clock read covers them all
+        current_time = time.monotonic()
+        no_face_frames = self.consecutive_frames_no_face
+        looking_away_frames = self.consecutive_frames_looking_away
+        face_absent_start = self.face_absent_start
+        looking_away_start = self.looking_away_start
+        
+        for event in batch:
+            is_no_face = event.event_type == "no_face"
+            is_looking_away = event.event_type == "looking_away"
+            
+            # Counters reset to 0 on any event of another type
+            no_face_frames = (no_face_frames + 1) * is_no_face
+            looking_away_frames = (looking_away_frames + 1) * is_looking_away
+            
+            # Intervals only open or close when the state flips
+            if is_no_face != (face_absent_start is not None):
+                if is_no_face:
+                    face_absent_start = current_time
+                else:
+                    self.total_no_face_time += current_time - face_absent_start
+                    face_absent_start = None
             
-        if event.event_type == "looking_away":
-            self.consecutive_frames_looking_away += 1
-            if self.looking_away_start is None:
-                self.looking_away_start = current_time
-        else:
-            if self.looking_away_start is not None:
-                self.total_looking_away_time += (current_time - self.looking_away_start).total_seconds()
-                self.looking_away_start = None
-            self.consecutive_frames_looking_away = 0
+            if is_looking_away != (looking_away_start is not None):
+                if is_looking_away:
+                    looking_away_start = current_time
+                else:
+                    self.total_looking_away_time += current_time - looking_away_start
+                    looking_away_start = None
+        
+        self.consecutive_frames_no_face = no_face_frames
+        self.consecutive_frames_looking_away = looking_away_frames
+        self.face_absent_start = face_absent_start
+        self.looking_away_start = looking_away_start
+        self._update_time_violations()
+    
+    def _update_time_violations(self):
+        """Flag time-based integrity issues once the tracked totals cross their thresholds"""
+        self._looking_away_violation = self.total_looking_away_time > LOOKING_AWAY_VIOLATION_SECONDS
+        self._face_absent_violation = self.total_no_face_time > FACE_ABSENT_VIOLATION_SECONDS
     
     def end_session(self):
         """End the proctoring session"""
         self.end_time = datetime.now()
+        self._end_mono = time.monotonic()
+        self._summary = None
+        self._stats_cache_n = -1
+        self.events.flush()
         
         # Finalize any ongoing tracking
         if self.face_absent_start is not None:
-            self.total_no_face_time += (self.end_time - self.face_absent_start).total_seconds()
+            self.total_no_face_time += self._end_mono - self.face_absent_start
             
         if self.looking_away_start is not None:
-            self.total_looking_away_time += (self.end_time - self.looking_away_start).total_seconds()
+            self.total_looking_away_time += self._end_mono - self.looking_away_start
+        
+        self._update_time_violations()
     
     def get_duration(self) -> float:
         """Get session duration in seconds"""
-        end_time = self.end_time or datetime.now()
-        return (end_time - self.start_time).total_seconds()
+        end_mono = self._end_mono if self._end_mono is not None else time.monotonic()
+        return end_mono - self._start_mono
+    
+    def get_summary(self) -> Dict[str, Any]:
+        """Get the summary shown in session listings (cached after the session ends)"""
+        if self._summary is not None:
+            return self._summary
+        
+        summary = {
+            "session_id": self.session_id,
+            "candidate_name": self.candidate_name,
+            "start_time": self.start_time.isoformat(),
+            "status": "active" if self.end_time is None else "completed",
+            "duration": self.get_duration(),
+            "event_count": len(self.events)
+        }
+        if self.end_time is not None:
+            self._summary = summary
+        return summary
     
     def get_session_stats(self) -> Dict[str, Any]:
         """Get current session statistics"""
-        event_counts = {}
-        for event in self.events:
-            event_type = event.event_type
-            event_counts[event_type] = event_counts.get(event_type, 0) + 1
+        # Everything but the duration only changes when events are added or the
+        # session ends, so reuse the last dict and just refresh the duration
+        if self._stats_cache_n == len(self.events):
+            self._stats_cache["duration"] = self.get_duration()
+            return self._stats_cache
+        
+        event_counts = dict(self._event_counts)
         
         duration = self.get_duration()
         
-        return {
+        self._stats_cache_n = len(self.events)
+        self._stats_cache = {
             "session_id": self.session_id,
             "candidate_name": self.candidate_name,
             "duration": duration,
@@ -103,34 +325,32 @@ class ProctorSession:
             "consecutive_no_face_frames": self.consecutive_frames_no_face,
             "consecutive_looking_away_frames": self.consecutive_frames_looking_away,
             "integrity_issues": {
-                "looking_away_violations": self.total_looking_away_time > 5,  # >5 seconds
-                "face_absent_violations": self.total_no_face_time > 10,  # >10 seconds
-                "multiple_faces": event_counts.get("multiple_faces", 0) > 0,
-                "unauthorized_objects": event_counts.get("unauthorized_object", 0) > 0
+                "looking_away_violations": self._looking_away_violation,
+                "face_absent_violations": self._face_absent_violation,
+                "multiple_faces": self._multiple_faces_seen,
+                "unauthorized_objects": self._unauthorized_object_seen
             }
         }
+        return self._stats_cache
     
     def calculate_integrity_score(self) -> float:
         """Calculate integrity score (0-100)"""
         base_score = 100.0
         
-        # Deductions
-        event_counts = {}
-        for event in self.events:
-            event_type = event.event_type
-            event_counts[event_type] = event_counts.get(event_type, 0) + 1
+        # Deductions; pure arithmetic on tracked totals and the running event counts
+        event_counts = self._event_counts
         
         # Looking away deductions (1 point per 5 seconds)
-        looking_away_deduction = min(30, (self.total_looking_away_time / 5) * 1)
+        looking_away_deduction = min(30, self.total_looking_away_time / 5)
         
         # Face absent deductions (2 points per 10 seconds)
         face_absent_deduction = min(20, (self.total_no_face_time / 10) * 2)
         
         # Multiple faces deduction (5 points per occurrence)
-        multiple_faces_deduction = min(20, event_counts.get("multiple_faces", 0) * 5)
+        multiple_faces_deduction = min(20, event_counts["multiple_faces"] * 5)
         
         # Unauthorized objects deduction (10 points per occurrence)
-        unauthorized_objects_deduction = min(30, event_counts.get("unauthorized_object", 0) * 10)
+        unauthorized_objects_deduction = min(30, event_counts["unauthorized_object"] * 10)
         
         total_deduction = (looking_away_deduction + face_absent_deduction + 
                           multiple_faces_deduction + unauthorized_objects_deduction)
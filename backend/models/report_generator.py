@@ -1,14 +1,27 @@
 from datetime import datetime
-from typing import Dict, Any, List
-import json
+import csv
+import io
+from typing import Dict, Any, List, Tuple
 import os
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-import pandas as pd
+import weakref
+import numpy as np
+from .proctoring_session import (
+    EVENT_TYPES, OTHER_TYPE_CODE, SEVERITY_LEVELS, event_severity, json_dumps, severity_levels
+)
+
+# Consecutive events of one type that make a pattern worth reporting
+LOOKING_AWAY_RUN = 6
+NO_FACE_RUN = 4
+LOOKING_AWAY_CODE = EVENT_TYPES.index("looking_away")
+NO_FACE_CODE = EVENT_TYPES.index("no_face")
+
+def _first_run_end(mask: np.ndarray, length: int) -> int:
+    """Index of the element completing the first run of `length` True values, or -1"""
+    if len(mask) < length:
+        return -1
+    window_sums = np.convolve(mask.astype(np.intp), np.ones(length, dtype=np.intp), 'valid')
+    hits = np.flatnonzero(window_sums == length)
+    return int(hits[0]) + length - 1 if hits.size else -1
 
 class ReportGenerator:
     """Generates proctoring reports in various formats"""
@@ -16,15 +29,24 @@ class ReportGenerator:
     def __init__(self):
         self.reports_dir = "reports"
         os.makedirs(self.reports_dir, exist_ok=True)
+        # Per-session (key, event analysis, timeline); dropped with the session
+        self._report_cache = weakref.WeakKeyDictionary()
+        # PDF table styles, built with the first PDF
+        self._table_styles = None
         
     def generate_report(self, session) -> Dict[str, Any]:
         """Generate comprehensive session report"""
         stats = session.get_session_stats()
         integrity_score = session.calculate_integrity_score()
         
-        # Analyze events
-        event_analysis = self._analyze_events(session.events)
-        timeline = self._generate_timeline(session.events)
+        # Analyze events; reuse the last analysis until an event is added or the session ends
+        key = (session.session_id, len(session.events), session.end_time)
+        cached = self._report_cache.get(session)
+        if cached is not None and cached[0] == key:
+            _, event_analysis, timeline = cached
+        else:
+            event_analysis, timeline = self._scan_events(session.events)
+            self._report_cache[session] = (key, event_analysis, timeline)
         
         report = {
             "session_info": {
@@ -46,112 +68,89 @@ class ReportGenerator:
         
         return report
     
-    def _analyze_events(self, events: List) -> Dict[str, Any]:
-        """Analyze events for patterns and insights"""
-        analysis = {
-            "total_events": len(events),
-            "event_types": {},
-            "time_distribution": {},
-            "severity_breakdown": {
-                "low": 0,
-                "medium": 0,
-                "high": 0,
-                "critical": 0
-            },
-            "patterns": []
+    def _scan_events(self, events) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Analyze events for patterns and insights and build the timeline"""
+        # Materialize once; the log may be read back from disk
+        events = list(events)
+        n = len(events)
+        
+        # Count types, severities and hours vectorized
+        type_codes = np.fromiter((event.type_code for event in events), dtype=np.intp, count=n)
+        confidences = np.fromiter((event.confidence for event in events), dtype=np.float64, count=n)
+        hours = np.fromiter((event.hour for event in events), dtype=np.intp, count=n)
+        
+        levels = severity_levels(type_codes, confidences)
+        
+        type_counts = np.bincount(type_codes, minlength=OTHER_TYPE_CODE + 1)
+        level_counts = np.bincount(levels, minlength=len(SEVERITY_LEVELS))
+        hour_counts = np.bincount(hours, minlength=24)
+        looking_away_at = _first_run_end(type_codes == LOOKING_AWAY_CODE, LOOKING_AWAY_RUN)
+        no_face_at = _first_run_end(type_codes == NO_FACE_CODE, NO_FACE_RUN)
+        
+        event_types = {
+            EVENT_TYPES[code]: count
+            for code, count in enumerate(type_counts.tolist())
+            if count and code != OTHER_TYPE_CODE
         }
-        
-        for event in events:
-            event_type = event.event_type
-            confidence = event.confidence
-            
-            # Count event types
-            analysis["event_types"][event_type] = analysis["event_types"].get(event_type, 0) + 1
-            
-            # Analyze severity
-            severity = self._get_event_severity(event_type, confidence)
-            analysis["severity_breakdown"][severity] += 1
-            
-            # Time distribution (by hour)
-            hour = event.timestamp.hour
-            analysis["time_distribution"][hour] = analysis["time_distribution"].get(hour, 0) + 1
-        
-        # Detect patterns
-        analysis["patterns"] = self._detect_patterns(events)
-        
-        return analysis
-    
-    def _get_event_severity(self, event_type: str, confidence: float) -> str:
-        """Determine event severity"""
-        severity_map = {
-            "looking_away": "low" if confidence < 0.7 else "medium",
-            "no_face": "medium" if confidence < 0.8 else "high",
-            "multiple_faces": "high",
-            "unauthorized_object": "critical"
+        # Types outside EVENT_TYPES are rare; count them by name
+        if type_counts[OTHER_TYPE_CODE]:
+            for event in events:
+                if event.type_code == OTHER_TYPE_CODE:
+                    event_types[event.event_type] = event_types.get(event.event_type, 0) + 1
+        
+        time_distribution = {
+            hour: count for hour, count in enumerate(hour_counts.tolist()) if count
         }
         
-        return severity_map.get(event_type, "low")
-    
-    def _detect_patterns(self, events: List) -> List[str]:
-        """Detect concerning patterns in events"""
-        patterns = []
-        
-        if len(events) == 0:
-            return patterns
+        # Consecutive violations; each pattern is reported once, in the order they first occurred
+        patterns = [
+            message for at, message in sorted([
+                (looking_away_at, "Extended period of looking away detected"),
+                (no_face_at, "Extended absence from camera detected")
+            ]) if at >= 0
+        ]
+        analysis = {
+            "total_events": n,
+            "event_types": event_types,
+            "time_distribution": time_distribution,
+            "severity_breakdown": dict(zip(SEVERITY_LEVELS, level_counts.tolist())),
+            "patterns": patterns
+        }
         
-        # Check for consecutive violations
-        consecutive_looking_away = 0
-        consecutive_no_face = 0
+        # Events are stored in the order they happened, so the timeline needs no sort
+        timeline = []
+        object_types = set()
         
         for event in events:
-            if event.event_type == "looking_away":
-                consecutive_looking_away += 1
-                consecutive_no_face = 0
-            elif event.event_type == "no_face":
-                consecutive_no_face += 1
-                consecutive_looking_away = 0
-            else:
-                consecutive_looking_away = 0
-                consecutive_no_face = 0
-            
-            if consecutive_looking_away > 5:
-                patterns.append("Extended period of looking away detected")
-                consecutive_looking_away = 0
+            event_type = event.event_type
+            if event_type == "unauthorized_object":
+                object_types.add(event.details.get("object_type", "unknown"))
             
-            if consecutive_no_face > 3:
-                patterns.append("Extended absence from camera detected")
-                consecutive_no_face = 0
+            iso = event.timestamp_iso()
+            timeline.append({
+                "timestamp": iso,
+                "time_formatted": iso[11:19],  # HH:MM:SS of the cached ISO string
+                "event_type": event_type,
+                "severity": event.severity,
+                "confidence": round(event.confidence, 2),
+                "description": self._get_event_description(event),
+                "details": event.details
+            })
         
         # Check for multiple faces
-        multiple_faces_count = sum(1 for event in events if event.event_type == "multiple_faces")
+        multiple_faces_count = event_types.get("multiple_faces", 0)
         if multiple_faces_count > 0:
             patterns.append(f"Multiple people detected {multiple_faces_count} times")
         
         # Check for unauthorized objects
-        object_detections = [event for event in events if event.event_type == "unauthorized_object"]
-        if object_detections:
-            object_types = set(event.details.get("object_type", "unknown") for event in object_detections)
+        if object_types:
             patterns.append(f"Unauthorized objects detected: {', '.join(object_types)}")
         
-        return patterns
+        return analysis, timeline
     
-    def _generate_timeline(self, events: List) -> List[Dict[str, Any]]:
-        """Generate chronological timeline of events"""
-        timeline = []
-        
-        for event in events:
-            timeline_event = {
-                "timestamp": event.timestamp.isoformat(),
-                "time_formatted": event.timestamp.strftime("%H:%M:%S"),
-                "event_type": event.event_type,
-                "severity": self._get_event_severity(event.event_type, event.confidence),
-                "confidence": round(event.confidence, 2),
-                "description": self._get_event_description(event),
-                "details": event.details
-            }
-            timeline.append(timeline_event)
-        
-        return sorted(timeline, key=lambda x: x["timestamp"])
+    def _get_event_severity(self, event_type: str, confidence: float) -> str:
+        """Determine event severity"""
+        return event_severity(event_type, confidence)
     
     def _get_event_description(self, event) -> str:
         """Get human-readable event description"""
@@ -201,12 +200,54 @@ class ReportGenerator:
         
         return recommendations
     
+    def _get_table_styles(self):
+        """Get the (key/value, event summary) PDF table styles"""
+        if self._table_styles is None:
+            from reportlab.lib import colors
+            from reportlab.platypus import TableStyle
+            
+            header_and_body = [
+                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                ('GRID', (0, 0), (-1, -1), 1, colors.black)
+            ]
+            self._table_styles = (
+                TableStyle(header_and_body + [
+                    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                    ('FONTSIZE', (0, 0), (-1, 0), 14)
+                ]),
+                TableStyle(header_and_body + [
+                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                    ('FONTSIZE', (0, 0), (-1, 0), 12)
+                ])
+            )
+        return self._table_styles
+    
     def generate_pdf_report(self, session) -> str:
         """Generate PDF report"""
-        report_data = self.generate_report(session)
         filename = f"{self.reports_dir}/proctoring_report_{session.session_id}.pdf"
+        data = self.generate_pdf_bytes(session)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return filename
+    
+    def generate_pdf_bytes(self, session) -> bytes:
+        """Generate PDF report in memory"""
+        # reportlab is only needed here, so it is imported on first use
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib import colors
+        from reportlab.platypus import SimpleDocTemplate, Table, Paragraph, Spacer
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.lib.units import inch
+        
+        report_data = self.generate_report(session)
+        kv_table_style, event_table_style = self._get_table_styles()
         
-        doc = SimpleDocTemplate(filename, pagesize=A4)
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4)
         styles = getSampleStyleSheet()
         story = []
         
@@ -236,16 +277,7 @@ class ReportGenerator:
         ]
         
         session_table = Table(session_data, colWidths=[2*inch, 3*inch])
-        session_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        session_table.setStyle(kv_table_style)
         
         story.append(session_table)
         story.append(Spacer(1, 12))
@@ -264,16 +296,7 @@ class ReportGenerator:
         ]
         
         integrity_table = Table(integrity_data, colWidths=[2*inch, 3*inch])
-        integrity_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
+        integrity_table.setStyle(kv_table_style)
         
         story.append(integrity_table)
         story.append(Spacer(1, 12))
@@ -289,16 +312,7 @@ class ReportGenerator:
         
         if len(event_data) > 1:
             event_table = Table(event_data, colWidths=[2*inch, 1*inch, 1*inch])
-            event_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
+            event_table.setStyle(event_table_style)
             story.append(event_table)
         else:
             story.append(Paragraph("No events detected during session.", styles['Normal']))
@@ -312,24 +326,31 @@ class ReportGenerator:
         
         # Build PDF
         doc.build(story)
+        return buffer.getvalue()
+    
+    def generate_json_report(self, session) -> str:
+        """Save the session data and report as JSON"""
+        filename = f"{self.reports_dir}/proctoring_report_{session.session_id}.json"
+        
+        with open(filename, 'w') as f:
+            f.write(json_dumps({
+                "session": session.to_dict(),
+                "report": self.generate_report(session)
+            }))
+        
         return filename
     
     def generate_csv_report(self, session) -> str:
         """Generate CSV report for data analysis"""
         filename = f"{self.reports_dir}/proctoring_data_{session.session_id}.csv"
         
-        # Prepare event data
-        events_data = []
-        for event in session.events:
-            events_data.append({
-                "timestamp": event.timestamp.isoformat(),
-                "event_type": event.event_type,
-                "confidence": event.confidence,
-                "details": json.dumps(event.details)
-            })
-        
-        # Create DataFrame and save
-        df = pd.DataFrame(events_data)
-        df.to_csv(filename, index=False)
+        # Stream rows straight to disk
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["timestamp", "event_type", "confidence", "details"])
+            writer.writerows(
+                (event.timestamp_iso(), event.event_type, event.confidence, json_dumps(event.details))
+                for event in session.events
+            )
         
         return filename
\ No newline at end of file
@@ -80,6 +80,7 @@ export default function VideoStream({
 
     const connectWebSocket = () => {
       const ws = new WebSocket(`ws://localhost:8000/ws/${sessionId}`);
+      ws.binaryType = "arraybuffer";
 
       ws.onopen = () => {
         console.log("WebSocket connected");
@@ -89,9 +90,14 @@ export default function VideoStream({
 
       ws.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
-
-          if (data.type === "events" && data.events) {
+          // Updates arrive as UTF-8 JSON in binary frames
+          const text =
+            typeof event.data === "string"
+              ? event.data
+              : new TextDecoder().decode(event.data);
+          const data = JSON.parse(text);
+
+          if (data.type === "update" && data.events) {
             data.events.forEach((evt: DetectionEvent) => {
               onEvent(evt);
             });
@@ -147,19 +153,20 @@ export default function VideoStream({
         // Draw video frame to canvas
         ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-        // Convert to base64 and send
-        try {
-          const dataURL = canvas.toDataURL("image/jpeg", 0.8);
-          websocketRef.current.send(
-            JSON.stringify({
-              type: "frame",
-              frame: dataURL,
-              timestamp: new Date().toISOString(),
-            })
-          );
-        } catch (err) {
-          console.error("Failed to send frame:", err);
-        }
+        // Encode as JPEG and send the raw bytes (no base64/JSON wrapping)
+        canvas.toBlob(
+          (blob) => {
+            if (!blob || websocketRef.current?.readyState !== WebSocket.OPEN)
+              return;
+            try {
+              websocketRef.current.send(blob);
+            } catch (err) {
+              console.error("Failed to send frame:", err);
+            }
+          },
+          "image/jpeg",
+          0.8
+        );
       }
     };
 